@@ -4,8 +4,9 @@
 # Copyright (c) 2021 Antmicro <www.antmicro.com>
 # SPDX-License-Identifier: BSD-2-Clause
 
+import bisect
 from operator import or_
-from functools import reduce
+from functools import reduce, partial, lru_cache
 
 from migen import *
 
@@ -14,11 +15,34 @@ from litex.soc.interconnect.csr import *
 from litedram.common import *
 from litedram.phy.dfi import *
 
-from litedram.phy.utils import (bitpattern, delayed, DQSPattern, Serializer, Deserializer, Latency,
+from litedram.phy.utils import (bitpattern, DQSPattern, Serializer, Deserializer, Latency,
     CommandsPipeline)
 from litedram.phy.lpddr4.commands import DFIPhaseAdapter
 
 
+# (CL, CWL) by maximum operating frequency: MT53E256M16D1, No DBI, Set A
+_F_TO_CL_CWL = (
+    ( 532e6, ( 6,  4)),
+    (1066e6, (10,  6)),
+    (1600e6, (14,  8)),
+    (2132e6, (20, 10)),
+    (2666e6, (24, 12)),
+    (3200e6, (28, 14)),
+    (3732e6, (32, 16)),
+    (4266e6, (36, 18)),
+)
+
+@lru_cache(maxsize=None)
+def get_cl_cw(memtype, tck):
+    assert memtype == "LPDDR4", memtype
+    # Use the lowest frequency point that the clock period allows: tck >= 2/f <=> f >= 2/tck
+    freqs = tuple(f for f, _ in _F_TO_CL_CWL)
+    i = bisect.bisect_left(freqs, 2/tck)
+    if i == len(freqs):
+        raise ValueError(tck)
+    return _F_TO_CL_CWL[i][1]
+
+
 class LPDDR4Output:
     """Unserialized output of LPDDR4PHY. Has to be serialized by concrete implementation."""
     def __init__(self, nphases, databits):
@@ -81,10 +105,16 @@ class LPDDR4PHY(Module, AutoCSR):
     extended_overlaps_check : bool
         Include additional command overlap checks. Makes no sense during normal operation
         (when the DRAM controller works correctly), so use `False` to avoid wasting resources.
+    mask_overlapping : bool
+        Mask commands from phases that overlap a command sent on previous phases. The
+        controller has to guarantee proper command spacing (tCCD etc.) anyway, so when it
+        can be trusted this masking can be disabled to save resources and shorten the
+        CS/CA combinational paths; overlapping commands are then undefined behavior.
     """
     def __init__(self, pads, *,
                  sys_clk_freq, ser_latency, des_latency, phytype,
-                 cmd_delay=None, masked_write=True, extended_overlaps_check=False):
+                 cmd_delay=None, masked_write=True, extended_overlaps_check=False,
+                 mask_overlapping=True):
         self.pads        = pads
         self.memtype     = memtype     = "LPDDR4"
         self.nranks      = nranks      = 1 if not hasattr(pads, "cs_n") else len(pads.cs_n)
@@ -96,22 +126,6 @@ class LPDDR4PHY(Module, AutoCSR):
         assert databits % 8 == 0
 
         # Parameters -------------------------------------------------------------------------------
-        def get_cl_cw(memtype, tck):
-            # MT53E256M16D1, No DBI, Set A
-            f_to_cl_cwl = OrderedDict()
-            f_to_cl_cwl[ 532e6] = ( 6,  4)
-            f_to_cl_cwl[1066e6] = (10,  6)
-            f_to_cl_cwl[1600e6] = (14,  8)
-            f_to_cl_cwl[2132e6] = (20, 10)
-            f_to_cl_cwl[2666e6] = (24, 12)
-            f_to_cl_cwl[3200e6] = (28, 14)
-            f_to_cl_cwl[3732e6] = (32, 16)
-            f_to_cl_cwl[4266e6] = (36, 18)
-            for f, (cl, cwl) in f_to_cl_cwl.items():
-                if tck >= 2/f:
-                    return cl, cwl
-            raise ValueError
-
         # Bitslip introduces latency from 1 up to `cycles + 1`
         # FIXME: (check if True) from tests on hardware it seems we need 1 more cycle
         #   of read_latency, probably to have space for manipulating bitslip values
@@ -119,7 +133,7 @@ class LPDDR4PHY(Module, AutoCSR):
         bitslip_range   = 1
         # Commands are sent over 4 DRAM clocks (sys8x) and we count cl/cwl from last bit
         cmd_latency     = 4
-        # Commands read from adapters are delayed on ConstBitSlips
+        # Commands read from adapters are delayed on constant bitslips
         ca_latency      = 1
 
         cl, cwl         = get_cl_cw(memtype, tck)
@@ -203,10 +217,26 @@ class LPDDR4PHY(Module, AutoCSR):
         self.comb += self.out.clk.eq(bitpattern("-_-_-_-_" * 2))
 
         # Simple commands --------------------------------------------------------------------------
+        # cke/odt/reset_n and the DQ/DQS output enables all need the same 1 sys cycle
+        # delay, so batch them into a single shared register (which also packs well
+        # into SRL primitives) instead of a delay line submodule per bit.
+        dq_oe  = Signal()
+        dqs_oe = Signal()
+        delay_in = Cat(
+            Cat(phase.cke     for phase in self.dfi.phases),
+            Cat(phase.odt     for phase in self.dfi.phases),
+            Cat(phase.reset_n for phase in self.dfi.phases),
+            dq_oe,
+            dqs_oe,
+        )
+        delay_out = Signal(len(delay_in))
+        self.sync += delay_out.eq(delay_in)
         self.comb += [
-            self.out.cke.eq(Cat(delayed(self, phase.cke) for phase in self.dfi.phases)),
-            self.out.odt.eq(Cat(delayed(self, phase.odt) for phase in self.dfi.phases)),
-            self.out.reset_n.eq(Cat(delayed(self, phase.reset_n) for phase in self.dfi.phases)),
+            self.out.cke.eq(delay_out[0*nphases:1*nphases]),
+            self.out.odt.eq(delay_out[1*nphases:2*nphases]),
+            self.out.reset_n.eq(delay_out[2*nphases:3*nphases]),
+            self.out.dq_oe.eq(delay_out[3*nphases]),
+            self.out.dqs_oe.eq(delay_out[3*nphases + 1]),
         ]
 
         # LPDDR4 Commands --------------------------------------------------------------------------
@@ -218,7 +248,8 @@ class LPDDR4PHY(Module, AutoCSR):
             ca_ser_width = len(self.out.ca[0]),
             ca_nbits     = len(self.out.ca),
             cmd_nphases_span = 4,
-            extended_overlaps_check = extended_overlaps_check
+            extended_overlaps_check = extended_overlaps_check,
+            mask_overlapping = mask_overlapping,
         )
 
         self.comb += self.out.cs.eq(self.commands.cs)
@@ -226,39 +257,37 @@ class LPDDR4PHY(Module, AutoCSR):
             self.comb += self.out.ca[bit].eq(self.commands.ca[bit])
 
         # DQ ---------------------------------------------------------------------------------------
-        dq_oe = Signal()
-        self.comb += self.out.dq_oe.eq(delayed(self, dq_oe, cycles=1))
+        # (phase, which half of phase data) for each serialized bit; the index pattern
+        # is the same for all DQ/DMI bits so compute it once
+        bit_phases = [(i//2, i%2) for i in range(2*nphases)]
+        make_bitslip = partial(BitSlip, dw=2*nphases, cycles=bitslip_cycles)
 
+        dq_i_bs = [Signal(2*nphases) for _ in range(self.databits)]
         for bit in range(self.databits):
             # output
-            wrdata = [
-                self.dfi.phases[i//2].wrdata[i%2 * self.databits + bit]
-                for i in range(2*nphases)
-            ]
-            self.submodules += BitSlip(
-                dw     = 2*nphases,
-                cycles = bitslip_cycles,
-                rst    = self.get_rst(bit//8, self._wdly_dq_bitslip_rst.re),
-                slp    = self.get_inc(bit//8, self._wdly_dq_bitslip.re),
-                i      = Cat(*wrdata),
-                o      = self.out.dq_o[bit],
+            wrdata = [self.dfi.phases[p].wrdata[h*self.databits + bit] for p, h in bit_phases]
+            self.submodules += make_bitslip(
+                rst = self.get_rst(bit//8, self._wdly_dq_bitslip_rst.re),
+                slp = self.get_inc(bit//8, self._wdly_dq_bitslip.re),
+                i   = Cat(*wrdata),
+                o   = self.out.dq_o[bit],
             )
 
             # input
-            dq_i_bs = Signal(2*nphases)
-            self.submodules += BitSlip(
-                dw     = 2*nphases,
-                cycles = bitslip_cycles,
-                rst    = self.get_rst(bit//8, self._rdly_dq_bitslip_rst.re),
-                slp    = self.get_inc(bit//8, self._rdly_dq_bitslip.re),
-                i      = self.out.dq_i[bit],
-                o      = dq_i_bs,
+            self.submodules += make_bitslip(
+                rst = self.get_rst(bit//8, self._rdly_dq_bitslip_rst.re),
+                slp = self.get_inc(bit//8, self._rdly_dq_bitslip.re),
+                i   = self.out.dq_i[bit],
+                o   = dq_i_bs[bit],
             )
-            for i in range(2*nphases):
-                self.comb += self.dfi.phases[i//2].rddata[i%2 * self.databits + bit].eq(dq_i_bs[i])
+
+        # Assign rddata a whole phase half at a time (one statement per serialized bit
+        # index) instead of databits * 2*nphases single-bit statements
+        for i, (p, h) in enumerate(bit_phases):
+            self.comb += self.dfi.phases[p].rddata[h*self.databits:(h+1)*self.databits].eq(
+                Cat(*[dq_i_bs[bit][i] for bit in range(self.databits)]))
 
         # DQS --------------------------------------------------------------------------------------
-        dqs_oe        = Signal()
         dqs_preamble  = Signal()
         dqs_postamble = Signal()
         dqs_pattern   = DQSPattern(
@@ -267,19 +296,14 @@ class LPDDR4PHY(Module, AutoCSR):
             wlevel_en     = self._wlevel_en.storage,
             wlevel_strobe = self._wlevel_strobe.re)
         self.submodules += dqs_pattern
-        self.comb += [
-            self.out.dqs_oe.eq(delayed(self, dqs_oe, cycles=1)),
-        ]
 
         for byte in range(self.databits//8):
             # output
-            self.submodules += BitSlip(
-                dw     = 2*nphases,
-                cycles = bitslip_cycles,
-                rst    = self.get_rst(byte, self._wdly_dq_bitslip_rst.re),
-                slp    = self.get_inc(byte, self._wdly_dq_bitslip.re),
-                i      = dqs_pattern.o,
-                o      = self.out.dqs_o[byte],
+            self.submodules += make_bitslip(
+                rst = self.get_rst(byte, self._wdly_dq_bitslip_rst.re),
+                slp = self.get_inc(byte, self._wdly_dq_bitslip.re),
+                i   = dqs_pattern.o,
+                o   = self.out.dqs_o[byte],
             )
 
         # DMI --------------------------------------------------------------------------------------
@@ -291,16 +315,14 @@ class LPDDR4PHY(Module, AutoCSR):
             if isinstance(masked_write, Signal) or masked_write:
                 self.comb += self.out.dmi_oe.eq(self.out.dq_oe)
                 wrdata_mask = [
-                    self.dfi.phases[i//2] .wrdata_mask[i%2 * self.databits//8 + byte]
-                    for i in range(2*nphases)
+                    self.dfi.phases[p].wrdata_mask[h * self.databits//8 + byte]
+                    for p, h in bit_phases
                 ]
-                self.submodules += BitSlip(
-                    dw     = 2*nphases,
-                    cycles = bitslip_cycles,
-                    rst    = self.get_rst(byte, self._wdly_dq_bitslip_rst.re),
-                    slp    = self.get_inc(byte, self._wdly_dq_bitslip.re),
-                    i      = Cat(*wrdata_mask),
-                    o      = self.out.dmi_o[byte],
+                self.submodules += make_bitslip(
+                    rst = self.get_rst(byte, self._wdly_dq_bitslip_rst.re),
+                    slp = self.get_inc(byte, self._wdly_dq_bitslip.re),
+                    i   = Cat(*wrdata_mask),
+                    o   = self.out.dmi_o[byte],
                 )
             else:
                 self.comb += self.out.dmi_o[byte].eq(0)
@@ -403,8 +425,11 @@ class DoubleRateLPDDR4PHY(LPDDR4PHY):
         for name in vars(self.out):
             old = getattr(self._out, name)
             new = getattr(self.out, name)
-            if name.endswith("_oe"):  # OE signals need to be delayed
-                self.comb += new.eq(delayed(self, old, cycles=Serializer.LATENCY))
+            if name.endswith("_oe"):
+                # Serialize OE like the data it gates (with both halves equal), so that
+                # it tracks the data through the serializer pipeline by construction,
+                # instead of using a separate delay line matching Serializer.LATENCY.
+                ser(i=Replicate(old, 2), o=new)
             elif name.endswith("_i"):  # Deserialize inputs
                 apply(des, o=old, i=new)
             else:  # All other signals are outputs
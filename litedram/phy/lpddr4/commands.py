@@ -6,6 +6,7 @@
 
 import re
 import enum
+import functools
 
 from migen import *
 
@@ -73,6 +74,18 @@ class DFIPhaseAdapter(Module):
     valid : Signal, out
         Indicates that a valid command is presented on the `cs` and `ca` outputs.
     """
+    # DFI commands as (cas, ras, we), shared by all adapters
+    DFI_COMMANDS = {
+        "NOP": 0b000,
+        "ACT": 0b010,
+        "RD":  0b100,
+        "WR":  0b101,
+        "PRE": 0b011,
+        "REF": 0b110,
+        "ZQC": 0b001,
+        "MRS": 0b111,
+    }
+
     def __init__(self, dfi_phase, masked_write=True):
         assert isinstance(masked_write, (bool, Signal)), "Use boolean (static) or Signal (dynamic)"
         if isinstance(masked_write, bool):
@@ -100,16 +113,7 @@ class DFIPhaseAdapter(Module):
 
         dfi_cmd = Signal(3)
         self.comb += dfi_cmd.eq(Cat(~dfi_phase.we_n, ~dfi_phase.ras_n, ~dfi_phase.cas_n)),
-        _cmd = {  # cas, ras, we
-            "NOP": 0b000,
-            "ACT": 0b010,
-            "RD":  0b100,
-            "WR":  0b101,
-            "PRE": 0b011,
-            "REF": 0b110,
-            "ZQC": 0b001,
-            "MRS": 0b111,
-        }
+        _cmd = self.DFI_COMMANDS
 
         def cmds(cmd1, cmd2, valid=1):
             return self.cmd1.set(cmd1) + self.cmd2.set(cmd2) + [self.valid.eq(valid)]
@@ -176,9 +180,14 @@ class Command(Module):
         "DESELECT":     ["X X X X X X",         "X X X X X X"],
     }
 
-    for cmd, (subcmd1, subcmd2) in TRUTH_TABLE.items():
-        assert len(subcmd1.split()) == 6, (cmd, subcmd1)
-        assert len(subcmd2.split()) == 6, (cmd, subcmd2)
+    # TRUTH_TABLE with descriptions split into per-bit tokens; parsed once at class
+    # definition instead of on every `set` call (there are 2 commands per adapter and
+    # 8 adapters per PHY, all reading the same table)
+    PARSED_TRUTH_TABLE = {cmd: [desc.split() for desc in descs] for cmd, descs in TRUTH_TABLE.items()}
+
+    for cmd, (subcmd1, subcmd2) in PARSED_TRUTH_TABLE.items():
+        assert len(subcmd1) == 6, (cmd, subcmd1)
+        assert len(subcmd2) == 6, (cmd, subcmd2)
 
     def __init__(self, dfi_phase):
         self.cs = Signal(2)
@@ -187,34 +196,46 @@ class Command(Module):
 
     def set(self, cmd):
         ops = []
-        for cyc, description in enumerate(self.TRUTH_TABLE[cmd]):
-            for bit, bit_desc in enumerate(description.split()):
+        for cyc, description in enumerate(self.PARSED_TRUTH_TABLE[cmd]):
+            for bit, bit_desc in enumerate(description):
                 ops.append(self.ca[cyc][bit].eq(self.parse_bit(bit_desc, is_mrw=cmd.startswith("MRW"))))
         if cmd != "DESELECT":
             ops.append(self.cs[0].eq(1))
         return ops
 
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def parse_bit_description(bit):
+        """Split a bit description into (name, index args)
+
+        This is pure string processing, identical for every adapter/phase and PHY
+        instantiation, so the results are cached at class level.
+        """
+        m = re.fullmatch(r"([A-Z]+)(\d+)?", bit)
+        if m is None:
+            raise ValueError(bit)
+        args = () if m.group(2) is None else (int(m.group(2)),)
+        return m.group(1), args
+
     def parse_bit(self, bit, is_mrw):
         assert len(self.dfi.bank) >= 6, "At least 6 DFI bankbits needed for Mode Register address"
         assert len(self.dfi.address) >= 17, "At least 17 DFI addressbits needed for row address"
         mr_address = self.dfi.bank if is_mrw else self.dfi.address
         rules = {
-            "H":        lambda: 1,  # high
-            "L":        lambda: 0,  # low
-            "V":        lambda: 0,  # defined logic
-            "X":        lambda: 0,  # don't care
-            "BL":       lambda: 0,  # on-the-fly burst length, not using
-            "AP":       lambda: self.dfi.address[10],  # auto precharge
-            "AB":       lambda: self.dfi.address[10],  # all banks
-            "BA(\\d+)": lambda i: self.dfi.bank[i],
-            "R(\\d+)":  lambda i: self.dfi.address[i],  # row
-            "C(\\d+)":  lambda i: self.dfi.address[i],  # column
-            "MA(\\d+)": lambda i: mr_address[i],  # mode register address
-            "OP(\\d+)": lambda i: self.dfi.address[i],  # mode register value, or operand for MPC
+            "H":  lambda: 1,  # high
+            "L":  lambda: 0,  # low
+            "V":  lambda: 0,  # defined logic
+            "X":  lambda: 0,  # don't care
+            "BL": lambda: 0,  # on-the-fly burst length, not using
+            "AP": lambda: self.dfi.address[10],  # auto precharge
+            "AB": lambda: self.dfi.address[10],  # all banks
+            "BA": lambda i: self.dfi.bank[i],
+            "R":  lambda i: self.dfi.address[i],  # row
+            "C":  lambda i: self.dfi.address[i],  # column
+            "MA": lambda i: mr_address[i],  # mode register address
+            "OP": lambda i: self.dfi.address[i],  # mode register value, or operand for MPC
         }
-        for pattern, value in rules.items():
-            m = re.match(pattern, bit)
-            if m:
-                args = [int(g) for g in m.groups()]
-                return value(*args)
-        raise ValueError(bit)
+        name, args = self.parse_bit_description(bit)
+        if name not in rules:
+            raise ValueError(bit)
+        return rules[name](*args)
@@ -9,7 +9,6 @@ import math
 from fractions import Fraction
 from functools import reduce
 from operator import or_
-from collections import defaultdict
 
 from migen import *
 
@@ -44,6 +43,27 @@ def edge(mod, cond):
     return  ~cond_d & cond
 
 
+def bitslip_window(mod, i):
+    """Registered 2-cycle history window of `i` for use with `static_bitslip`"""
+    r = Signal(2*len(i), reset_less=True)
+    mod.sync += r.eq(Cat(r[len(i):], i))
+    return r
+
+def static_bitslip(window, slp, dw, offset=0):
+    """Constant bitslip as a pure slice of a `bitslip_window` history
+
+    Equivalent to `ConstBitSlip(dw=dw, slp=slp, cycles=1)`, but because the slip
+    value is constant the output is just a wire selection from the registered
+    history window, so no submodule or per-slip registers are needed. The window
+    may hold several concatenated fields, `offset` selects the field to slip.
+    """
+    assert 0 <= slp < dw, (slp, dw)
+    width = len(window) // 2
+    assert offset + dw <= width, (offset, dw, width)
+    field_hist = Cat(window[offset:offset+dw], window[width+offset:width+offset+dw])
+    return field_hist[dw-slp:2*dw-slp]
+
+
 class ConstBitSlip(Module):
     def __init__(self, dw, slp, cycles, i=None, o=None, register=True):
         self.i = Signal(dw, name='i') if i is None else i
@@ -153,6 +173,11 @@ class CommandsPipeline(Module):
     during the previous phasess. This is more expensive in terms of resources and generally
     not needed.
 
+    The controller has to guarantee proper command spacing (tCCD etc.) anyway, so when it
+    can be trusted the masking can be disabled entirely with `mask_overlapping=False` to
+    save the history/masking resources; overlapping commands are then simply ORed, which
+    is undefined behavior.
+
     Adapters have to provide the following fields: valid, cs, ca.
     """
     def __init__(self, adapters, *,
@@ -160,7 +185,8 @@ class CommandsPipeline(Module):
             ca_ser_width,  # n bits serialized in controller cycle (depends on CA being SDR/DDR)
             ca_nbits,      # number of CA lines (LPDDR4/5 -> 6/7)
             cmd_nphases_span,  # at most how many phases can a command span
-            extended_overlaps_check=False):
+            extended_overlaps_check=False,
+            mask_overlapping=True):
         nphases = len(adapters)
         self.cs = Signal(cs_ser_width)
         self.ca = [Signal(ca_ser_width) for _ in range(ca_nbits)]
@@ -174,45 +200,71 @@ class CommandsPipeline(Module):
         assert ca_ser_width % cs_ser_width == 0, f"Non-integer CA:CS output width ratio: {ca_ser_width % cs_ser_width}"
         ca_phase_slip = ca_ser_width // cs_ser_width
 
-        # Create a history of valid adapters used for masking overlapping ones
-        valids = ConstBitSlip(dw=nphases, slp=0, cycles=1, register=False)
-        self.submodules += valids
-        self.comb += valids.i.eq(Cat(a.valid for a in adapters))
-        valids_hist = valids.r
-        if extended_overlaps_check:
-            valids_hist = Signal.like(valids.r)
-            for i in range(len(valids_hist)):
-                hist_before = valids_hist[max(0, i-n_previous):i]
-                was_valid_before = reduce(or_, hist_before, 0)
-                self.comb += valids_hist[i].eq(valids.r[i] & ~was_valid_before)
-
-        cs_per_adapter = []
-        ca_per_adapter = defaultdict(list)
+        assert mask_overlapping or not extended_overlaps_check
+
+        if mask_overlapping:
+            # Create a history of valid adapters used for masking overlapping ones
+            valids = ConstBitSlip(dw=nphases, slp=0, cycles=1, register=False)
+            self.submodules += valids
+            self.comb += valids.i.eq(Cat(a.valid for a in adapters))
+            valids_hist = valids.r
+            if extended_overlaps_check:
+                valids_hist = Signal.like(valids.r)
+                # Valids are masked by the masked previous ones, so this is inherently
+                # a per-bit recurrence and cannot be vectorized like the window below.
+                for i in range(len(valids_hist)):
+                    hist_before = valids_hist[max(0, i-n_previous):i]
+                    self.comb += valids_hist[i].eq(valids.r[i] & ~reduce(or_, hist_before, 0))
+
+            # OR of valids on the `n_previous` phases before each one, computed once as a
+            # rolling window over the whole history vector instead of a fresh reduce per
+            # phase, so all `allowed` bits share a single expression tree.
+            was_valid_before = Signal(len(valids_hist))
+            self.comb += was_valid_before.eq(reduce(or_, [valids_hist << (k+1) for k in range(n_previous)]))
+
+        # CS and all CA bits of an adapter are masked by the same `allowed` bit and
+        # slipped by the same (constant) amount, so concatenate them into one vector:
+        # this needs a single history window register per adapter and a single OR
+        # over adapters instead of one per output signal.
+        def ca_offset(bit):
+            return cs_ser_width + bit*ca_ser_width
+
+        def padded(src, dw):
+            # zero-pad to the full serialization width so window offsets line up
+            if len(src) < dw:
+                src = Cat(src, C(0, dw - len(src)))
+            return src
+
+        merged_per_adapter = []
         for phase, adapter in enumerate(adapters):
-            # The signals from an adapter can be used if there were no commands on previous cycles
-            allowed = ~reduce(or_, valids_hist[nphases+phase - n_previous:nphases+phase])
-
-            # Use CS and CA of given adapter slipped by `phase` bits
-            cs_bs = ConstBitSlip(dw=cs_ser_width, slp=phase, cycles=1)
-            self.submodules += cs_bs
-            cs_mask = Replicate(allowed, len(cs_bs.i))
-            self.comb += cs_bs.i.eq(Cat(adapter.cs) & cs_mask),
-            cs_per_adapter.append(cs_bs.o)
-
-            # For CA we need to do the same for each bit
-            ca_bits = []
+            fields = [(Cat(adapter.cs), cs_ser_width)]
             for bit in range(ca_nbits):
-                ca_bs = ConstBitSlip(dw=ca_ser_width, slp=phase*ca_phase_slip, cycles=1)
-                self.submodules += ca_bs
                 ca_bit_hist = [ca[bit] for ca in adapter.ca]
-                ca_mask = Replicate(allowed, len(ca_bs.o))
-                self.comb += ca_bs.i.eq(Cat(*ca_bit_hist) & ca_mask),
-                ca_per_adapter[bit].append(ca_bs.o)
-
-        # OR all the masked signals
-        self.comb += self.cs.eq(reduce(or_, cs_per_adapter))
+                fields.append((Cat(*ca_bit_hist), ca_ser_width))
+            if mask_overlapping:
+                # The signals from an adapter can be used if there were no commands on
+                # previous cycles. AND the 1-bit mask into the narrow source vectors
+                # before zero-padding: padding and the slip permutation distribute over
+                # AND with a scalar, so this is equivalent to masking the full-width
+                # outputs while needing only len(src)-wide gates.
+                allowed = ~was_valid_before[nphases+phase]
+                fields = [(src & Replicate(allowed, len(src)), dw) for src, dw in fields]
+            window = bitslip_window(self, Cat(*[padded(src, dw) for src, dw in fields]))
+
+            # Use CS and CA of given adapter slipped by `phase` bits; the slips are
+            # constant so these are pure wire selections from the shared window.
+            slipped = [static_bitslip(window, phase, cs_ser_width)]
+            for bit in range(ca_nbits):
+                slipped.append(static_bitslip(window, phase*ca_phase_slip, ca_ser_width,
+                    offset=ca_offset(bit)))
+            merged_per_adapter.append(Cat(*slipped))
+
+        # OR the masked vectors of all adapters at once, then slice the outputs back out
+        merged = Signal(cs_ser_width + ca_nbits*ca_ser_width)
+        self.comb += merged.eq(reduce(or_, merged_per_adapter))
+        self.comb += self.cs.eq(merged[:cs_ser_width])
         for bit in range(ca_nbits):
-            self.comb += self.ca[bit].eq(reduce(or_, ca_per_adapter[bit]))
+            self.comb += self.ca[bit].eq(merged[ca_offset(bit):ca_offset(bit)+ca_ser_width])
 
 
 class Serializer(Module):
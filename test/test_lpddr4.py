@@ -221,6 +221,22 @@ class LPDDR4Tests(unittest.TestCase):
                     pad_checkers = {"sys8x_90": pads},
                 )
 
+    def test_lpddr4_command_overlaps_no_masking(self):
+        # Test that with mask_overlapping=False overlapping commands are just ORed
+        latency = '00000000' * self.CMD_LATENCY
+        read = dict(cs_n=0, cas_n=0, ras_n=1, we_n=1)
+        phy = LPDDR4SimPHY(sys_clk_freq=self.SYS_CLK_FREQ, mask_overlapping=False)
+        self.run_test(phy,
+            dfi_sequence = [
+                {0: read, 2: read, 6: read},
+                {},
+                {0: read, 2: read, 4: read},
+            ],
+            pad_checkers = {"sys8x_90": {
+                'cs': latency + '10101010'+'10000000'+'10101010',
+            }},
+        )
+
     def test_lpddr4_command_pads(self):
         # Test serialization of DFI command pins (cs/cke/odt/reset_n)
         latency = '00000000' * self.CMD_LATENCY
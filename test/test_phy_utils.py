@@ -10,7 +10,8 @@ from functools import partial
 
 from migen import *
 
-from litedram.phy.utils import Serializer, Deserializer, Latency, chunks, bit, ConstBitSlip
+from litedram.phy.utils import (Serializer, Deserializer, Latency, chunks, bit, ConstBitSlip,
+    bitslip_window, static_bitslip)
 
 import test.phy_common
 
@@ -247,3 +248,38 @@ class TestConstBitslip(unittest.TestCase):
 
                 dut = self.Dut(dw=4, slp=slp, cycles=1, register=False)
                 run_simulation(dut, generator(dut))
+
+
+class TestStaticBitslip(unittest.TestCase):
+    class Dut(Module):
+        def __init__(self, dw, slp):
+            self.i = Signal(dw)
+            self.o = Signal(dw)
+            window = bitslip_window(self, self.i)
+            self.comb += self.o.eq(static_bitslip(window, slp, dw))
+
+    def test_same_as_const_bitslip_register(self):
+        # static_bitslip should behave exactly like ConstBitSlip(cycles=1, register=True)
+        outputs = {
+            0: [0b0011, 0b0000],
+            1: [0b0110, 0b0000],
+            2: [0b1100, 0b0000],
+            3: [0b1000, 0b0001],
+        }
+
+        for slp, out in outputs.items():
+            with self.subTest(slp=slp):
+                def generator(dut):
+                    yield dut.i.eq(0b0011)
+                    yield
+                    self.assertEqual((yield dut.o), 0)
+                    yield dut.i.eq(0)
+                    yield
+                    self.assertEqual((yield dut.o), out[0])
+                    yield
+                    self.assertEqual((yield dut.o), out[1])
+                    yield
+                    self.assertEqual((yield dut.o), 0)
+
+                dut = self.Dut(dw=4, slp=slp)
+                run_simulation(dut, generator(dut))